@@ -0,0 +1,220 @@
+/*
+ * Copyright (C) 2009 Jelmer Vernooij <jelmer@jelmer.uk>
+ *
+ * Dulwich is dual-licensed under the Apache License, Version 2.0 and the GNU
+ * General Public License as public by the Free Software Foundation; version 2.0
+ * or (at your option) any later version. You can redistribute it and/or
+ * modify it under the terms of either of these two licenses.
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ *
+ * You should have received a copy of the licenses; if not, see
+ * <http://www.gnu.org/licenses/> for a copy of the GNU General Public License
+ * and <http://www.apache.org/licenses/LICENSE-2.0> for a copy of the Apache
+ * License, Version 2.0.
+ */
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <string.h>
+
+static PyObject *GitProtocolError = NULL, *HangupException = NULL;
+
+/**
+ * Branchless SWAR decode of a 4-character hex length prefix.
+ *
+ * (c & 0x0f) + 9 * (c >> 6) decodes digits and letters of either case in
+ * one pass over all four bytes. The decoded nibbles are re-encoded as
+ * lowercase hex and compared against the input, case-folded only in the
+ * letter lanes, to reject non-hex characters without a per-character
+ * branch. Folding digit lanes too would falsely accept bytes 0x10-0x19.
+ *
+ * Returns: The decoded length, or -1 on invalid input.
+ */
+static long hex4(const unsigned char *p)
+{
+	uint32_t x, v, letters, enc;
+	const unsigned char *lanes;
+
+	memcpy(&x, p, 4);
+	v = (x & 0x0f0f0f0f) + (((x >> 6) & 0x01010101) * 9);
+	letters = ((v + 0x06060606) & 0x10101010) >> 4;
+	enc = v + 0x30303030 + letters * 0x27;
+	if (enc != (x | letters * 0x20) || (v & 0xf0f0f0f0))
+		return -1;
+	/* Byte lanes of v line up with p regardless of endianness. */
+	lanes = (const unsigned char *)&v;
+	return ((long)lanes[0] << 12) | ((long)lanes[1] << 8) |
+	       ((long)lanes[2] << 4) | (long)lanes[3];
+}
+
+/**
+ * Parse a pkt-line length prefix of hex digits.
+ *
+ * Returns: The decoded length, or -1 with ValueError set on invalid input.
+ */
+static long parse_length_prefix(const char *hex, Py_ssize_t len)
+{
+	long size = 0;
+	Py_ssize_t i;
+	if (len == 4) {
+		size = hex4((const unsigned char *)hex);
+		if (size == -1)
+			PyErr_Format(PyExc_ValueError,
+				"invalid pkt-line length prefix: '%.4s'", hex);
+		return size;
+	}
+	for (i = 0; i < len; i++) {
+		char c = hex[i];
+		int digit;
+		if (c >= '0' && c <= '9')
+			digit = c - '0';
+		else if (c >= 'a' && c <= 'f')
+			digit = c - 'a' + 10;
+		else if (c >= 'A' && c <= 'F')
+			digit = c - 'A' + 10;
+		else {
+			PyErr_Format(PyExc_ValueError,
+				"invalid pkt-line length prefix: '%.4s'", hex);
+			return -1;
+		}
+		size = size * 16 + digit;
+	}
+	return size;
+}
+
+static int report_read(PyObject *report_activity, long size)
+{
+	PyObject *res;
+	int truth;
+
+	if (report_activity == NULL || report_activity == Py_None)
+		return 0;
+	truth = PyObject_IsTrue(report_activity);
+	if (truth == -1)
+		return -1;
+	if (!truth)
+		return 0;
+	res = PyObject_CallFunction(report_activity, "ls", size, "read");
+	if (res == NULL)
+		return -1;
+	Py_DECREF(res);
+	return 0;
+}
+
+static PyObject *py_read_pkt_line(PyObject *self, PyObject *args)
+{
+	PyObject *read, *report_activity = Py_None;
+	PyObject *sizestr, *contents;
+	char *hex;
+	Py_ssize_t hexlen, contents_len;
+	long size;
+	int truth;
+	char msg[80];
+
+	if (!PyArg_ParseTuple(args, "O|O", &read, &report_activity))
+		return NULL;
+
+	sizestr = PyObject_CallFunction(read, "i", 4);
+	if (sizestr == NULL)
+		return NULL;
+	truth = PyObject_IsTrue(sizestr);
+	if (truth == -1) {
+		Py_DECREF(sizestr);
+		return NULL;
+	}
+	if (!truth) {
+		Py_DECREF(sizestr);
+		PyErr_SetNone(HangupException);
+		return NULL;
+	}
+	if (PyBytes_AsStringAndSize(sizestr, &hex, &hexlen) == -1) {
+		Py_DECREF(sizestr);
+		return NULL;
+	}
+	size = parse_length_prefix(hex, hexlen);
+	Py_DECREF(sizestr);
+	if (size == -1)
+		return NULL;
+	if (size == 0) {
+		if (report_read(report_activity, 4) == -1)
+			return NULL;
+		Py_RETURN_NONE;
+	}
+	if (report_read(report_activity, size) == -1)
+		return NULL;
+	contents = PyObject_CallFunction(read, "l", size - 4);
+	if (contents == NULL)
+		return NULL;
+	contents_len = PyObject_Length(contents);
+	if (contents_len == -1) {
+		Py_DECREF(contents);
+		return NULL;
+	}
+	if (contents_len + 4 != size) {
+		Py_DECREF(contents);
+		snprintf(msg, sizeof(msg),
+			"Length of pkt read %04lx does not match length prefix %04lx",
+			(unsigned long)(contents_len + 4), (unsigned long)size);
+		PyErr_SetString(GitProtocolError, msg);
+		return NULL;
+	}
+	return contents;
+}
+
+static PyMethodDef py_protocol_methods[] = {
+	{ "_read_pkt_line", (PyCFunction)py_read_pkt_line, METH_VARARGS,
+	  "Read a single pkt-line using a read callback." },
+	{ NULL, NULL, 0, NULL }
+};
+
+static PyObject *moduleinit(void)
+{
+	PyObject *m, *errors_mod;
+
+	static struct PyModuleDef moduledef = {
+		PyModuleDef_HEAD_INIT,
+		"_protocol",         /* m_name */
+		NULL,                /* m_doc */
+		-1,                  /* m_size */
+		py_protocol_methods, /* m_methods */
+		NULL,                /* m_reload */
+		NULL,                /* m_traverse */
+		NULL,                /* m_clear */
+		NULL,                /* m_free */
+	};
+
+	errors_mod = PyImport_ImportModule("dulwich.errors");
+	if (errors_mod == NULL)
+		return NULL;
+
+	GitProtocolError = PyObject_GetAttrString(errors_mod, "GitProtocolError");
+	HangupException = PyObject_GetAttrString(errors_mod, "HangupException");
+	Py_DECREF(errors_mod);
+	if (GitProtocolError == NULL || HangupException == NULL) {
+		Py_XDECREF(GitProtocolError);
+		Py_XDECREF(HangupException);
+		return NULL;
+	}
+
+	m = PyModule_Create(&moduledef);
+	if (m == NULL) {
+		Py_DECREF(GitProtocolError);
+		Py_DECREF(HangupException);
+		return NULL;
+	}
+
+	return m;
+}
+
+PyMODINIT_FUNC
+PyInit__protocol(void)
+{
+	return moduleinit();
+}
@@ -39,10 +39,11 @@ Known capabilities that are not supported:
 """
 
 from contextlib import closing
+from functools import lru_cache
 from io import BytesIO, BufferedReader
 import logging
 import os
-import select
+import selectors
 import socket
 import subprocess
 import sys
@@ -57,6 +58,10 @@ from urllib.parse import (
     urlunparse,
 )
 
+if sys.platform == "win32":
+    import msvcrt
+    from ctypes import byref, wintypes, windll
+
 import dulwich
 from dulwich.config import get_xdg_config_home_path
 from dulwich.errors import (
@@ -96,6 +101,7 @@ from dulwich.protocol import (
     SIDE_BAND_CHANNEL_FATAL,
     PktLineParser,
     Protocol,
+    pkt_line,
     ProtocolFile,
     TCP_GIT_PORT,
     ZERO_SHA,
@@ -133,15 +139,21 @@ class HTTPUnauthorized(Exception):
         self.url = url
 
 
-def _fileno_can_read(fileno):
-    """Check if a file descriptor is readable."""
-    return len(select.select([fileno], [], [], 0)[0]) > 0
+def _selector_can_read(fileobj):
+    """Return a can_read callback backed by a persistent selector.
+
+    selectors.DefaultSelector picks epoll/kqueue where available, so the
+    descriptor is registered with the kernel once and each readability
+    check is O(1), instead of rebuilding select()/poll() state per call.
+    The selector is kept alive for the lifetime of the connection.
+    """
+    sel = selectors.DefaultSelector()
+    sel.register(fileobj, selectors.EVENT_READ)
+    return lambda: bool(sel.select(0))
 
 
 def _win32_peek_avail(handle):
     """Wrapper around PeekNamedPipe to check how many bytes are available."""
-    from ctypes import byref, wintypes, windll
-
     c_avail = wintypes.DWORD()
     c_message = wintypes.DWORD()
     success = windll.kernel32.PeekNamedPipe(
@@ -164,6 +176,10 @@ RECEIVE_CAPABILITIES = [
     CAPABILITY_DELETE_REFS,
 ] + COMMON_CAPABILITIES
 
+# Number of 'have' lines to accumulate before issuing a single batched write
+# during fetch-pack negotiation, mirroring C git's pipelined have batching.
+_HAVE_WINDOW_SIZE = 32
+
 
 class ReportStatusParser(object):
     """Handle status as reported by servers with 'report-status' capability."""
@@ -183,14 +199,21 @@ class ReportStatusParser(object):
         """
         if self._pack_status not in (b"unpack ok", None):
             raise SendPackError(self._pack_status)
-        for status in self._ref_statuses:
-            try:
-                status, rest = status.split(b" ", 1)
-            except ValueError:
+        for status_line in self._ref_statuses:
+            # Split manually with find() so each line is scanned only once
+            # and 'ng' lines without a message are tolerated.
+            sp = status_line.find(b" ")
+            if sp < 0:
                 # malformed response, move on to the next one
                 continue
+            status = status_line[:sp]
+            rest = status_line[sp + 1:]
             if status == b"ng":
-                ref, error = rest.split(b" ", 1)
+                sp = rest.find(b" ")
+                if sp < 0:
+                    ref, error = rest, b""
+                else:
+                    ref, error = rest[:sp], rest[sp + 1:]
                 yield ref, error.decode("utf-8")
             elif status == b"ok":
                 yield rest, None
@@ -221,9 +244,18 @@ def read_pkt_refs(proto):
     refs = {}
     # Receive refs from server
     for pkt in proto.read_pkt_seq():
-        (sha, ref) = pkt.rstrip(b"\n").split(None, 1)
-        if sha == b"ERR":
-            raise GitProtocolError(ref.decode("utf-8", "replace"))
+        if pkt.startswith(b"ERR "):
+            raise GitProtocolError(
+                pkt[4:].rstrip(b"\n").decode("utf-8", "replace")
+            )
+        # A ref line is always a 40-byte hex sha, a space and the ref name;
+        # slice at fixed offsets rather than allocating an rstrip and split
+        # result per advertised ref.
+        sha = pkt[:40]
+        if pkt.endswith(b"\n"):
+            ref = pkt[41:-1]
+        else:
+            ref = pkt[41:]
         if server_capabilities is None:
             (ref, server_capabilities) = extract_capabilities(ref)
         refs[ref] = sha
@@ -552,7 +584,9 @@ class GitClient(object):
         to fetch. Receives dictionary of name->sha, should return
         list of shas to fetch.
           graph_walker: Object with next() and ack().
-          pack_data: Callback called for each bit of data in the pack
+          pack_data: Callback called for each bit of data in the pack;
+        may receive any bytes-like buffer object (e.g. memoryview), not
+        only bytes, and must copy the data if it keeps a reference
           progress: Callback for progress reports (strings)
           depth: Shallow fetch depth
 
@@ -583,22 +617,43 @@ class GitClient(object):
           channel_callbacks: Dictionary mapping channels to packet
             handlers to use. None for a callback discards channel data.
         """
+        def discard(pkt):
+            pass
+
+        # Precompute a dispatch table indexed by the channel byte; channel
+        # numbers are small ints, so list indexing avoids a dict lookup per
+        # packet.
+        cbs = [None] * (max(channel_callbacks) + 1)
+        for channel, cb in channel_callbacks.items():
+            cbs[channel] = cb if cb is not None else discard
+
         for pkt in proto.read_pkt_seq():
-            channel = ord(pkt[:1])
-            pkt = pkt[1:]
+            channel = pkt[0]
             try:
-                cb = channel_callbacks[channel]
-            except KeyError:
+                cb = cbs[channel]
+            except IndexError:
+                cb = None
+            if cb is None:
                 raise AssertionError("Invalid sideband channel %d" % channel)
+            if channel == SIDE_BAND_CHANNEL_DATA:
+                # Pass the pack payload as a memoryview; file-like write()
+                # accepts buffer objects without copying, which avoids a
+                # fresh bytes slice for every 64k packet of a potentially
+                # multi-gigabyte pack.
+                cb(memoryview(pkt)[1:])
             else:
-                if cb is not None:
-                    cb(pkt)
+                cb(pkt[1:])
 
     @staticmethod
     def _should_send_pack(new_refs):
         # The packfile MUST NOT be sent if the only command used is delete.
         return any(sha != ZERO_SHA for sha in new_refs.values())
 
+    @staticmethod
+    def _refs_up_to_date(new_refs, old_refs):
+        # Iterate rather than materializing two sets of (ref, sha) pairs.
+        return all(old_refs.get(ref) == sha for ref, sha in new_refs.items())
+
     def _handle_receive_pack_head(self, proto, capabilities, old_refs, new_refs):
         """Handle the head of a 'git-receive-pack' request.
 
@@ -613,7 +668,11 @@ class GitClient(object):
         """
         want = []
         have = [x for x in old_refs.values() if not x == ZERO_SHA]
+        # Membership tests below run once per pushed ref; use a set so the
+        # loop stays linear for repositories with many refs.
+        have_set = set(have)
         sent_capabilities = False
+        capabilities_suffix = b"\0" + b" ".join(sorted(capabilities))
 
         for refname in new_refs:
             if not isinstance(refname, bytes):
@@ -642,11 +701,10 @@ class GitClient(object):
                         + new_sha1
                         + b" "
                         + refname
-                        + b"\0"
-                        + b" ".join(sorted(capabilities))
+                        + capabilities_suffix
                     )
                     sent_capabilities = True
-            if new_sha1 not in have and new_sha1 != ZERO_SHA:
+            if new_sha1 not in have_set and new_sha1 != ZERO_SHA:
                 want.append(new_sha1)
         proto.write_pkt_line(None)
         return (have, want)
@@ -768,24 +826,53 @@ class GitClient(object):
         else:
             new_shallow = new_unshallow = set()
             proto.write_pkt_line(None)
+        have_buf = bytearray()
+
+        def flush_haves():
+            if have_buf:
+                proto.write(bytes(have_buf))
+                proto.flush()
+                if proto.report_activity:
+                    proto.report_activity(len(have_buf), "write")
+                del have_buf[:]
+
         have = next(graph_walker)
+        if not have:
+            # Fresh clone: there are no common commits to negotiate, so
+            # skip the have/ACK machinery and go straight to 'done'.
+            proto.write_pkt_line(COMMAND_DONE + b"\n")
+            proto.flush()
+            return (new_shallow, new_unshallow)
+        have_count = 0
+        ready = False
         while have:
-            proto.write_pkt_line(COMMAND_HAVE + b" " + have + b"\n")
-            if can_read is not None and can_read():
-                pkt = proto.read_pkt_line()
-                parts = pkt.rstrip(b"\n").split(b" ")
-                if parts[0] == b"ACK":
-                    graph_walker.ack(parts[1])
-                    if parts[2] in (b"continue", b"common"):
-                        pass
-                    elif parts[2] == b"ready":
-                        break
-                    else:
-                        raise AssertionError(
-                            "%s not in ('continue', 'ready', 'common)" % parts[2]
-                        )
+            have_buf += pkt_line(COMMAND_HAVE + b" " + have + b"\n")
+            have_count += 1
+            # Batch haves into windows and only poll for ACKs between full
+            # windows; short negotiations gain nothing from pipelining.
+            if have_count % _HAVE_WINDOW_SIZE == 0:
+                flush_haves()
+                while can_read is not None and can_read():
+                    pkt = proto.read_pkt_line()
+                    parts = pkt.rstrip(b"\n").split(b" ")
+                    if parts[0] == b"ACK":
+                        graph_walker.ack(parts[1])
+                        if parts[2] in (b"continue", b"common"):
+                            pass
+                        elif parts[2] == b"ready":
+                            ready = True
+                            break
+                        else:
+                            raise AssertionError(
+                                "%s not in ('continue', 'ready', 'common)"
+                                % parts[2]
+                            )
+                if ready:
+                    break
             have = next(graph_walker)
+        flush_haves()
         proto.write_pkt_line(COMMAND_DONE + b"\n")
+        proto.flush()
         return (new_shallow, new_unshallow)
 
     def _handle_upload_pack_tail(
@@ -810,8 +897,7 @@ class GitClient(object):
         Returns:
 
         """
-        pkt = proto.read_pkt_line()
-        while pkt:
+        for pkt in iter(proto.read_pkt_line, None):
             parts = pkt.rstrip(b"\n").split(b" ")
             if parts[0] == b"ACK":
                 graph_walker.ack(parts[1])
@@ -821,7 +907,6 @@ class GitClient(object):
                 b"common",
             ):
                 break
-            pkt = proto.read_pkt_line()
         if CAPABILITY_SIDE_BAND_64K in capabilities:
             if progress is None:
                 # Just ignore progress data
@@ -904,7 +989,10 @@ class TraditionalGitClient(GitClient):
         Receive dict with existing remote refs, returns dict with
         changed refs (name -> sha, where sha=ZERO_SHA for deletions)
           generate_pack_data: Function that can return a tuple with
-        number of objects and pack data to upload.
+        number of objects and pack data to upload. If the returned pack
+        data object has a sendfile_to method, it is called with the
+        transport file and is expected to write the pack bytes to it,
+        instead of serializing through write_pack_data.
           progress: Optional callback called with progress updates
 
         Returns:
@@ -934,7 +1022,7 @@ class TraditionalGitClient(GitClient):
                 proto.write_pkt_line(None)
                 raise
 
-            if set(new_refs.items()).issubset(set(old_refs.items())):
+            if self._refs_up_to_date(new_refs, old_refs):
                 proto.write_pkt_line(None)
                 return SendPackResult(new_refs, agent=agent, ref_status={})
 
@@ -974,7 +1062,17 @@ class TraditionalGitClient(GitClient):
             )
 
             if self._should_send_pack(new_refs):
-                write_pack_data(proto.write_file(), pack_data_count, pack_data)
+                sendfile_to = getattr(pack_data, "sendfile_to", None)
+                if sendfile_to is not None:
+                    # Producers that already have the generated pack bytes
+                    # (mirror pushes) can stream them to the transport
+                    # file via write(), skipping re-serialization.
+                    sendfile_to(proto.write_file())
+                else:
+                    write_pack_data(
+                        proto.write_file(), pack_data_count, pack_data
+                    )
+                proto.flush()
 
             ref_status = self._handle_receive_pack_tail(
                 proto, negotiated_capabilities, progress
@@ -998,7 +1096,9 @@ class TraditionalGitClient(GitClient):
         to fetch. Receives dictionary of name->sha, should return
         list of shas to fetch.
           graph_walker: Object with next() and ack().
-          pack_data: Callback called for each bit of data in the pack
+          pack_data: Callback called for each bit of data in the pack;
+        may receive any bytes-like buffer object (e.g. memoryview), not
+        only bytes, and must copy the data if it keeps a reference
           progress: Callback for progress reports (strings)
           depth: Shallow fetch depth
 
@@ -1108,6 +1208,47 @@ class TraditionalGitClient(GitClient):
             )
 
 
+class _BufferedSocketReader(object):
+    """File-like reader over a socket using a persistent receive buffer.
+
+    Reading through socket.makefile stacks another layer of buffered-IO
+    copying on top of the pkt-line framing. This reads with recv_into()
+    into a single preallocated bytearray and serves read() calls from it.
+    """
+
+    def __init__(self, sock, bufsize=131072):
+        self._sock = sock
+        self._buf = bytearray(bufsize)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+
+    def read(self, size):
+        """Read exactly size bytes, or fewer if the peer hangs up."""
+        remaining = self._end - self._start
+        if remaining >= size:
+            start = self._start
+            self._start += size
+            return bytes(self._view[start:start + size])
+        chunks = [bytes(self._view[self._start:self._end])]
+        got = remaining
+        self._start = self._end = 0
+        while got < size:
+            n = self._sock.recv_into(self._buf)
+            if n == 0:
+                break
+            need = size - got
+            if n <= need:
+                chunks.append(bytes(self._view[:n]))
+                got += n
+            else:
+                chunks.append(bytes(self._view[:need]))
+                self._start = need
+                self._end = n
+                got = size
+        return b"".join(chunks)
+
+
 class TCPGitClient(TraditionalGitClient):
     """A Git Client that works over TCP directly (i.e. git://)."""
 
@@ -1151,13 +1292,16 @@ class TCPGitClient(TraditionalGitClient):
                 s = None
         if s is None:
             raise err
-        # -1 means system default buffering
-        rfile = s.makefile("rb", -1)
-        # 0 means unbuffered
-        wfile = s.makefile("wb", 0)
+        # Read with recv_into() into a persistent buffer instead of going
+        # through socket.makefile's extra layer of buffered-IO copying.
+        rfile = _BufferedSocketReader(s)
+        # Buffer writes so the many small pkt-lines written during
+        # negotiation are coalesced rather than each becoming a send()
+        # syscall and a tiny TCP segment; the protocol flushes at request
+        # section boundaries.
+        wfile = s.makefile("wb", 65536)
 
         def close():
-            rfile.close()
             wfile.close()
             s.close()
 
@@ -1166,12 +1310,14 @@ class TCPGitClient(TraditionalGitClient):
             wfile.write,
             close,
             report_activity=self._report_activity,
+            flush=wfile.flush,
         )
         if path.startswith(b"/~"):
             path = path[1:]
         # TODO(jelmer): Alternative to ascii?
         proto.send_cmd(b"git-" + cmd, path, b"host=" + self._host.encode("ascii"))
-        return proto, lambda: _fileno_can_read(s), None
+        proto.flush()
+        return proto, _selector_can_read(s), None
 
 
 class SubprocessWrapper(object):
@@ -1181,6 +1327,7 @@ class SubprocessWrapper(object):
         self.proc = proc
         self.read = BufferedReader(proc.stdout).read
         self.write = proc.stdin.write
+        self._can_read = None
 
     @property
     def stderr(self):
@@ -1188,12 +1335,12 @@ class SubprocessWrapper(object):
 
     def can_read(self):
         if sys.platform == "win32":
-            from msvcrt import get_osfhandle
-
-            handle = get_osfhandle(self.proc.stdout.fileno())
+            handle = msvcrt.get_osfhandle(self.proc.stdout.fileno())
             return _win32_peek_avail(handle) != 0
         else:
-            return _fileno_can_read(self.proc.stdout.fileno())
+            if self._can_read is None:
+                self._can_read = _selector_can_read(self.proc.stdout)
+            return self._can_read()
 
     def close(self):
         self.proc.stdin.close()
@@ -1311,16 +1458,19 @@ class LocalGitClient(GitClient):
             new_refs = update_refs(dict(old_refs))
 
             have = [sha1 for sha1 in old_refs.values() if sha1 != ZERO_SHA]
+            have_set = set(have)
             want = []
+            want_set = set()
             for refname, new_sha1 in new_refs.items():
                 if (
-                    new_sha1 not in have
-                    and new_sha1 not in want
+                    new_sha1 not in have_set
+                    and new_sha1 not in want_set
                     and new_sha1 != ZERO_SHA
                 ):
                     want.append(new_sha1)
+                    want_set.add(new_sha1)
 
-            if not want and set(new_refs.items()).issubset(set(old_refs.items())):
+            if not want and self._refs_up_to_date(new_refs, old_refs):
                 return SendPackResult(new_refs, ref_status={})
 
             target.object_store.add_pack_data(
@@ -1385,7 +1535,9 @@ class LocalGitClient(GitClient):
         to fetch. Receives dictionary of name->sha, should return
         list of shas to fetch.
           graph_walker: Object with next() and ack().
-          pack_data: Callback called for each bit of data in the pack
+          pack_data: Callback called for each bit of data in the pack;
+        may receive any bytes-like buffer object (e.g. memoryview), not
+        only bytes, and must copy the data if it keeps a reference
           progress: Callback for progress reports (strings)
           depth: Shallow fetch depth
 
@@ -1673,7 +1825,7 @@ class SSHGitClient(TraditionalGitClient):
 def default_user_agent_string():
     # Start user agent with "git/", because GitHub requires this. :-( See
     # https://github.com/jelmer/dulwich/issues/562 for details.
-    return "git/dulwich/%s" % ".".join([str(x) for x in dulwich.__version__])
+    return "git/dulwich/%s" % ".".join(str(x) for x in dulwich.__version__)
 
 
 def default_urllib3_manager(   # noqa: C901
@@ -1982,7 +2134,7 @@ class HttpGitClient(GitClient):
         if new_refs is None:
             # Determine wants function is aborting the push.
             return SendPackResult(old_refs, agent=agent, ref_status={})
-        if set(new_refs.items()).issubset(set(old_refs.items())):
+        if self._refs_up_to_date(new_refs, old_refs):
             return SendPackResult(new_refs, agent=agent, ref_status={})
         if self.dumb:
             raise NotImplementedError(self.fetch_pack)
@@ -2025,7 +2177,9 @@ class HttpGitClient(GitClient):
           path: Path to fetch from
           determine_wants: Callback that returns list of commits to fetch
           graph_walker: Object with next() and ack().
-          pack_data: Callback called for each bit of data in the pack
+          pack_data: Callback called for each bit of data in the pack;
+        may receive any bytes-like buffer object (e.g. memoryview), not
+        only bytes, and must copy the data if it keeps a reference
           progress: Callback for progress reports (strings)
           depth: Depth for request
 
@@ -2084,6 +2238,17 @@ class HttpGitClient(GitClient):
         return refs
 
 
+@lru_cache(maxsize=256)
+def _parse_url(url):
+    """Parse a URL, caching the result.
+
+    urlparse() is called afresh for every connection; tools that resolve
+    many locations in a tight loop (batch mirroring) hit the same URLs
+    repeatedly. ParseResult is an immutable tuple, so sharing is safe.
+    """
+    return urlparse(url)
+
+
 def get_transport_and_path_from_url(url, config=None, **kwargs):
     """Obtain a git client from a URL.
 
@@ -2098,7 +2263,7 @@ def get_transport_and_path_from_url(url, config=None, **kwargs):
       Tuple with client instance and relative path.
 
     """
-    parsed = urlparse(url)
+    parsed = _parse_url(url)
     if parsed.scheme == "git":
         return (TCPGitClient.from_parsedurl(parsed, **kwargs), parsed.path)
     elif parsed.scheme in ("git+ssh", "ssh"):
@@ -22,9 +22,6 @@
 """Generic functions for talking the git smart server protocol."""
 
 from io import BytesIO
-from os import (
-    SEEK_END,
-)
 import socket
 
 import dulwich
@@ -181,6 +178,34 @@ def pkt_line(data):
     return ("%04x" % (len(data) + 4)).encode("ascii") + data
 
 
+def _read_pkt_line(read, report_activity=None):
+    """Read a single pkt-line using a read callback.
+
+    Args:
+      read: Callback for reading a number of bytes
+      report_activity: Optional callback for reporting activity
+    Returns: The pkt-line payload, without the length prefix, or None for a
+        flush-pkt ('0000').
+    """
+    sizestr = read(4)
+    if not sizestr:
+        raise HangupException()
+    size = int(sizestr, 16)
+    if size == 0:
+        if report_activity:
+            report_activity(4, "read")
+        return None
+    if report_activity:
+        report_activity(size, "read")
+    pkt_contents = read(size - 4)
+    if len(pkt_contents) + 4 != size:
+        raise GitProtocolError(
+            "Length of pkt read %04x does not match length prefix %04x"
+            % (len(pkt_contents) + 4, size)
+        )
+    return pkt_contents
+
+
 class Protocol(object):
     """Class for interacting with a remote git process over the wire.
 
@@ -193,10 +218,11 @@ class Protocol(object):
         Documentation/technical/protocol-common.txt
     """
 
-    def __init__(self, read, write, close=None, report_activity=None):
+    def __init__(self, read, write, close=None, report_activity=None, flush=None):
         self.read = read
         self.write = write
         self._close = close
+        self._flush = flush
         self.report_activity = report_activity
         self._readahead = None
 
@@ -204,6 +230,11 @@ class Protocol(object):
         if self._close:
             self._close()
 
+    def flush(self):
+        """Flush any buffered output, if the transport buffers writes."""
+        if self._flush:
+            self._flush()
+
     def __enter__(self):
         return self
 
@@ -225,26 +256,9 @@ class Protocol(object):
             self._readahead = None
 
         try:
-            sizestr = read(4)
-            if not sizestr:
-                raise HangupException()
-            size = int(sizestr, 16)
-            if size == 0:
-                if self.report_activity:
-                    self.report_activity(4, "read")
-                return None
-            if self.report_activity:
-                self.report_activity(size, "read")
-            pkt_contents = read(size - 4)
+            return _read_pkt_line(read, self.report_activity)
         except socket.error as e:
             raise GitProtocolError(e)
-        else:
-            if len(pkt_contents) + 4 != size:
-                raise GitProtocolError(
-                    "Length of pkt read %04x does not match length prefix %04x"
-                    % (len(pkt_contents) + 4, size)
-                )
-            return pkt_contents
 
     def eof(self):
         """Test whether the protocol stream has reached EOF.
@@ -295,8 +309,13 @@ class Protocol(object):
             prefix.
         """
         try:
+            is_flush_pkt = line is None
             line = pkt_line(line)
             self.write(line)
+            if is_flush_pkt:
+                # A flush-pkt ends a request section; make sure it reaches
+                # the peer before the caller starts waiting for a response.
+                self.flush()
             if self.report_activity:
                 self.report_activity(len(line), "write")
         except socket.error as e:
@@ -380,92 +399,47 @@ class ReceivableProtocol(Protocol):
             self.read, write, close=close, report_activity=report_activity
         )
         self._recv = recv
-        self._rbuf = BytesIO()
+        # Single scratch buffer reused across all reads; surplus bytes from
+        # recv() are kept here rather than in a fresh BytesIO per call.
+        self._rbuf = bytearray()
         self._rbufsize = rbufsize
 
     def read(self, size):
-        # From _fileobj.read in socket.py in the Python 2.6.5 standard library,
-        # with the following modifications:
-        #  - omit the size <= 0 branch
-        #  - seek back to start rather than 0 in case some buffer has been
-        #    consumed.
-        #  - use SEEK_END instead of the magic number.
-        # Copyright (c) 2001-2010 Python Software Foundation; All Rights
-        # Reserved
-        # Licensed under the Python Software Foundation License.
-        # TODO: see if buffer is more efficient than cBytesIO.
         assert size > 0
 
-        # Our use of BytesIO rather than lists of string objects returned by
-        # recv() minimizes memory usage and fragmentation that occurs when
-        # rbufsize is large compared to the typical return value of recv().
         buf = self._rbuf
-        start = buf.tell()
-        buf.seek(0, SEEK_END)
-        # buffer may have been partially consumed by recv()
-        buf_len = buf.tell() - start
-        if buf_len >= size:
-            # Already have size bytes in our buffer?  Extract and return.
-            buf.seek(start)
-            rv = buf.read(size)
-            self._rbuf = BytesIO()
-            self._rbuf.write(buf.read())
-            self._rbuf.seek(0)
-            return rv
-
-        self._rbuf = BytesIO()  # reset _rbuf.  we consume it via buf.
-        while True:
-            left = size - buf_len
-            # recv() will malloc the amount of memory given as its
-            # parameter even though it often returns much less data
-            # than that.  The returned data string is short lived
-            # as we copy it into a BytesIO and free it.  This avoids
-            # fragmentation issues on many platforms.
+        while len(buf) < size:
+            left = size - len(buf)
             data = self._recv(left)
             if not data:
                 break
-            n = len(data)
-            if n == size and not buf_len:
-                # Shortcut.  Avoid buffer data copies when:
-                # - We have no data in our buffer.
-                # AND
-                # - Our call to recv returned exactly the
-                #   number of bytes we were asked to read.
+            if not buf and len(data) == size:
+                # Shortcut: the buffer was empty and recv returned exactly
+                # the number of bytes we were asked to read.
                 return data
-            if n == left:
-                buf.write(data)
-                del data  # explicit free
-                break
-            assert n <= left, "_recv(%d) returned %d bytes" % (left, n)
-            buf.write(data)
-            buf_len += n
-            del data  # explicit free
-            # assert buf_len == buf.tell()
-        buf.seek(start)
-        return buf.read()
+            assert len(data) <= left, "_recv(%d) returned %d bytes" % (
+                left,
+                len(data),
+            )
+            buf += data
+        rv = bytes(buf[:size])
+        del buf[:size]
+        return rv
 
     def recv(self, size):
         assert size > 0
 
         buf = self._rbuf
-        start = buf.tell()
-        buf.seek(0, SEEK_END)
-        buf_len = buf.tell()
-        buf.seek(start)
-
-        left = buf_len - start
-        if not left:
+        if not buf:
             # only read from the wire if our read buffer is exhausted
             data = self._recv(self._rbufsize)
             if len(data) == size:
                 # shortcut: skip the buffer if we read exactly size bytes
                 return data
-            buf = BytesIO()
-            buf.write(data)
-            buf.seek(0)
-            del data  # explicit free
-            self._rbuf = buf
-        return buf.read(size)
+            buf += data
+        rv = bytes(buf[:size])
+        del buf[:size]
+        return rv
 
 
 def extract_capabilities(text):
@@ -581,3 +555,12 @@ class PktLineParser(object):
     def get_tail(self):
         """Read back any unused data."""
         return self._readahead.getvalue()
+
+
+# Hold on to the pure-python implementation for testing.
+_read_pkt_line_py = _read_pkt_line
+try:
+    # Try to import C version
+    from dulwich._protocol import _read_pkt_line  # type: ignore
+except ImportError:
+    pass
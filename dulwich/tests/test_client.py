@@ -347,6 +347,39 @@ class GitClientTests(TestCase):
             + f.getvalue(),
         )
 
+    def test_send_pack_prebuilt_pack(self):
+        self.rin.write(
+            b"0063310ca9477129b8586fa2afc779c1f57cf64bba6c "
+            b"refs/heads/master\x00report-status delete-refs ofs-delta\n"
+            b"0000000eunpack ok\n"
+            b"0019ok refs/heads/blah12\n"
+            b"0000"
+        )
+        self.rin.seek(0)
+
+        class PrebuiltPackData(object):
+            def __init__(self):
+                self.sent = False
+
+            def sendfile_to(self, f):
+                self.sent = True
+                f.write(b"PACK-bytes")
+
+        pack_data = PrebuiltPackData()
+
+        def update_refs(refs):
+            return {
+                b"refs/heads/blah12": b"310ca9477129b8586fa2afc779c1f57cf64bba6c",
+                b"refs/heads/master": b"310ca9477129b8586fa2afc779c1f57cf64bba6c",
+            }
+
+        def generate_pack_data(have, want, ofs_delta=False):
+            return 0, pack_data
+
+        self.client.send_pack(b"/", update_refs, generate_pack_data)
+        self.assertTrue(pack_data.sent)
+        self.assertTrue(self.rout.getvalue().endswith(b"PACK-bytes"))
+
     def test_send_pack_new_ref(self):
         self.rin.write(
             b"0064310ca9477129b8586fa2afc779c1f57cf64bba6c "
@@ -801,6 +834,13 @@ class ReportStatusParserTests(TestCase):
         parser.handle_packet(None)
         self.assertEqual([(b"refs/foo/bar", "need to pull")], list(parser.check()))
 
+    def test_update_refs_error_no_message(self):
+        parser = ReportStatusParser()
+        parser.handle_packet(b"unpack ok")
+        parser.handle_packet(b"ng refs/foo/bar")
+        parser.handle_packet(None)
+        self.assertEqual([(b"refs/foo/bar", "")], list(parser.check()))
+
     def test_ok(self):
         parser = ReportStatusParser()
         parser.handle_packet(b"unpack ok")
@@ -809,6 +849,44 @@ class ReportStatusParserTests(TestCase):
         self.assertEqual([(b"refs/foo/bar", None)], list(parser.check()))
 
 
+class BufferedSocketReaderTests(TestCase):
+    def _make_reader(self, chunks, bufsize=16):
+        chunks = list(chunks)
+
+        class FakeSocket(object):
+            def recv_into(self, buf):
+                if not chunks:
+                    return 0
+                chunk = chunks.pop(0)
+                n = min(len(chunk), len(buf))
+                buf[:n] = chunk[:n]
+                if n < len(chunk):
+                    chunks.insert(0, chunk[n:])
+                return n
+
+        return client._BufferedSocketReader(FakeSocket(), bufsize=bufsize)
+
+    def test_read_exact(self):
+        reader = self._make_reader([b"0123456789"])
+        self.assertEqual(b"0123", reader.read(4))
+        self.assertEqual(b"456789", reader.read(6))
+
+    def test_read_across_chunks(self):
+        reader = self._make_reader([b"0123", b"4567", b"89"])
+        self.assertEqual(b"01234567", reader.read(8))
+
+    def test_read_short_at_eof(self):
+        reader = self._make_reader([b"89"])
+        self.assertEqual(b"89", reader.read(4))
+        self.assertEqual(b"", reader.read(4))
+
+    def test_read_buffers_surplus(self):
+        reader = self._make_reader([b"abcdefgh"])
+        self.assertEqual(b"ab", reader.read(2))
+        self.assertEqual(b"cd", reader.read(2))
+        self.assertEqual(b"efgh", reader.read(4))
+
+
 class LocalGitClientTests(TestCase):
     def test_get_url(self):
         path = "/tmp/repo.git"
@@ -38,8 +38,87 @@ from dulwich.protocol import (
     MULTI_ACK,
     MULTI_ACK_DETAILED,
     BufferedPktLineWriter,
+    _read_pkt_line,
+    _read_pkt_line_py,
 )
 from dulwich.tests import TestCase
+from dulwich.tests.utils import (
+    ext_functest_builder,
+    functest_builder,
+)
+
+
+class ReadPktLineTests(TestCase):
+    def _do_test_read(self, read_pkt_line):
+        self.assertEqual(b"cmd ", read_pkt_line(BytesIO(b"0008cmd ").read))
+
+    test_read = functest_builder(_do_test_read, _read_pkt_line_py)
+    test_read_extension = ext_functest_builder(_do_test_read, _read_pkt_line)
+
+    def _do_test_read_flush(self, read_pkt_line):
+        self.assertEqual(None, read_pkt_line(BytesIO(b"0000").read))
+
+    test_read_flush = functest_builder(_do_test_read_flush, _read_pkt_line_py)
+    test_read_flush_extension = ext_functest_builder(
+        _do_test_read_flush, _read_pkt_line
+    )
+
+    def _do_test_read_hangup(self, read_pkt_line):
+        self.assertRaises(HangupException, read_pkt_line, BytesIO(b"").read)
+
+    test_read_hangup = functest_builder(_do_test_read_hangup, _read_pkt_line_py)
+    test_read_hangup_extension = ext_functest_builder(
+        _do_test_read_hangup, _read_pkt_line
+    )
+
+    def _do_test_read_wrong_size(self, read_pkt_line):
+        self.assertRaises(
+            GitProtocolError, read_pkt_line, BytesIO(b"0100too short").read
+        )
+
+    test_read_wrong_size = functest_builder(
+        _do_test_read_wrong_size, _read_pkt_line_py
+    )
+    test_read_wrong_size_extension = ext_functest_builder(
+        _do_test_read_wrong_size, _read_pkt_line
+    )
+
+    def _do_test_read_invalid_size(self, read_pkt_line):
+        self.assertRaises(ValueError, read_pkt_line, BytesIO(b"zzzzdata").read)
+        # Bytes 0x10-0x19 case-fold onto '0'-'9' and must not be accepted
+        # as digits.
+        for pos in range(4):
+            prefix = bytearray(b"0008")
+            prefix[pos] = 0x13
+            self.assertRaises(
+                ValueError, read_pkt_line, BytesIO(bytes(prefix) + b"cmd ").read
+            )
+
+    test_read_invalid_size = functest_builder(
+        _do_test_read_invalid_size, _read_pkt_line_py
+    )
+    test_read_invalid_size_extension = ext_functest_builder(
+        _do_test_read_invalid_size, _read_pkt_line
+    )
+
+    def _do_test_read_report_activity(self, read_pkt_line):
+        activity = []
+
+        def report_activity(length, direction):
+            activity.append((length, direction))
+
+        self.assertEqual(
+            b"cmd ",
+            read_pkt_line(BytesIO(b"0008cmd ").read, report_activity),
+        )
+        self.assertEqual([(8, "read")], activity)
+
+    test_read_report_activity = functest_builder(
+        _do_test_read_report_activity, _read_pkt_line_py
+    )
+    test_read_report_activity_extension = ext_functest_builder(
+        _do_test_read_report_activity, _read_pkt_line
+    )
 
 
 class BaseProtocolTests(object):
@@ -69,6 +69,7 @@ ext_modules = [
     Extension('dulwich._objects', ['dulwich/_objects.c']),
     Extension('dulwich._pack', ['dulwich/_pack.c']),
     Extension('dulwich._diff_tree', ['dulwich/_diff_tree.c']),
+    Extension('dulwich._protocol', ['dulwich/_protocol.c']),
 ]
 
 setup_kwargs = {}  # type: Dict[str, Any]